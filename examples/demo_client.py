@@ -21,7 +21,7 @@ async def main():
             test_data = []
             for i in range(10):
                 test_data.append((input_data + str(i)).encode("utf-8"))
-            await linux_adapter.send_data(neighbor["address"], test_data)
+            await linux_adapter.send_messages(neighbor["address"], test_data)
 
     await asyncio.get_running_loop().create_future()
 
@@ -38,6 +38,22 @@ async def on_data(data):
         print(f"Packets received: {num_packets_received}/{file_metadata['c']}, {num_packets_received/file_metadata['c']*100}% complete, {((file_metadata['c'] - num_packets_received)/num_packets_received)*(time.time() - start_time)} seconds remaining")
         file_data += data
 
+async def file_packets(file_path, packet_length_bytes=192):
+    # Read and encode the file one packet at a time so memory use doesn't grow with file size.
+    # 3 raw bytes encode to 4 base64 chars, so raw chunks of 3/4 the packet length keep padding
+    # on the last packet only and the chunks concatenate back into valid base64.
+    raw_chunk_bytes = packet_length_bytes // 4 * 3
+    file_size = os.path.getsize(file_path)
+    packet_count = (file_size + raw_chunk_bytes - 1) // raw_chunk_bytes
+    yield json.dumps({'t':'b64data','e': file_path.split(".")[-1],'c': packet_count}).encode("utf-8")
+    with open(file_path, "rb") as f:
+        while True:
+            chunk = await asyncio.to_thread(f.read, raw_chunk_bytes)
+            if not chunk:
+                break
+            yield base64.b64encode(chunk)
+    yield json.dumps({'t':'end'}).encode("utf-8")
+
 async def main():
     await linux_adapter.scan_for_mesh(on_device)
     await linux_adapter.advertise(linux_adapter.make_packet(0x01, linux_adapter.get_seqnum(), 5, linux_adapter.get_origin_id(), b""))
@@ -64,18 +80,7 @@ async def main():
             file_path = await asyncio.to_thread(input, "")
             if os.path.exists(file_path):
                 print(f"File {file_path} exists")
-                with open(file_path, "rb") as f:
-                    file_data = f.read()
-                    base64_data = base64.b64encode(file_data)
-                    packets = [{'t':'b64data','e': file_path.split(".")[-1],'c':0}]
-                    packet_length_bytes = 192
-                    for i in range(0, len(base64_data), packet_length_bytes):
-                        packets.append(base64_data[i:i+packet_length_bytes])
-                    packets.append({'t':'end'})
-                    packets[0]['c'] = len(packets) - 2 # remove protocol packets from count
-                    packets[0] = json.dumps(packets[0]).encode("utf-8")
-                    packets[-1] = json.dumps(packets[-1]).encode("utf-8")
-                    await linux_adapter.send_data(selectable_devices_list[device_num]["address"], packets)
+                await linux_adapter.schedule_send(selectable_devices_list[device_num]["address"], file_packets(file_path), linux_adapter.PRIORITY_BULK)
             else:
                 print("File does not exist")
                 continue
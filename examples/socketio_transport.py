@@ -14,41 +14,14 @@ app = socketio.ASGIApp(
 scan_handle = None
 advertise_handle = None
 
-class MessageQueue:
-    def __init__(self, timeout=5):
-        self.timeout = timeout
-        self.queue = []
-        self._handle = None
-        self._lock = asyncio.Lock()
-        self._loop = None
+async def send_to_neighbors(messages):
+    print(f"Flushing queue: {messages}")
+    neighbors = linux_adapter.get_neighbors()
+    for neighbor in neighbors.values():
+        await linux_adapter.send_messages(neighbor["address"], messages)
 
-    async def add_message(self, message):
-        if self._loop is None:
-            self._loop = asyncio.get_running_loop()
-        async with self._lock:
-            self.queue.append(message)
-            print(f"Message queued: {message}")
-
-            if self._handle is not None and not self._handle.cancelled():
-                self._handle.cancel()
-
-            self._handle = self._loop.call_later(self.timeout, lambda: asyncio.create_task(self.flush()))
-
-    async def flush(self):
-        async with self._lock:
-            if not self.queue:
-                return
-            messages = list(self.queue)
-            self.queue.clear()
-            self._handle = None
-
-        print(f"Flushing queue: {messages}")
-        packets = [m.encode("utf-8") for m in messages]
-        neighbors = linux_adapter.get_neighbors()
-        for neighbor in neighbors.values():
-            await linux_adapter.send_data(neighbor["address"], packets)
-
-mq = MessageQueue(timeout=5)
+# Messages typed within max_delay of each other share GATT writes
+mq = linux_adapter.MessageAggregator(send_to_neighbors, max_delay=0.5)
 
 async def bluetooth_setup():
     global scan_handle, advertise_handle
@@ -99,7 +72,7 @@ async def connect(sid, environ, auth):
 async def send_message(sid, data):
     print(f"Received message: {data}")
     data = json.loads(data)
-    await mq.add_message(linux_adapter.get_origin_id().hex() + data["message"])
+    await mq.add_message((linux_adapter.get_origin_id().hex() + data["message"]).encode("utf-8"))
 
 
 @sio.event
@@ -16,6 +16,33 @@ MESH_CHARACTERISTIC_UUID = "328c73ef-46e9-4718-9a1b-0dfd45691782"
 neighbor_table = {}
 known_devices = {}
 
+# Adapter roles. Adapters without an explicit entry in adapter_roles take every role,
+# so a single-dongle host behaves exactly as before.
+ADAPTER_ROLE_SCAN = "scan"
+ADAPTER_ROLE_CONNECT = "connect"
+ADAPTER_ROLES = (ADAPTER_ROLE_SCAN, ADAPTER_ROLE_CONNECT)
+adapter_roles = {}
+# Outbound connections currently open per adapter path, used to spread new connections
+adapter_load = {}
+
+# Aggregated frames pack several length-prefixed messages into one GATT write. They start
+# with a byte that can never begin a UTF-8 string so plain single-message writes still work,
+# followed by the total frame length so receivers can reassemble long writes.
+FRAME_MARKER = 0xFE
+FRAME_LENGTH_BYTES = 2
+FRAME_HEADER_BYTES = 1 + FRAME_LENGTH_BYTES
+# BlueZ caps attribute values at 512 bytes; the link MTU lowers this once it is known
+MAX_FRAME_BYTES = 512
+# ATT MTU reported by the last connection to each device address
+link_mtu = {}
+
+# Send priority classes, highest first. Weights set how many packets each class gets per
+# round when several classes are waiting for the same destination.
+PRIORITY_CONTROL = "control"
+PRIORITY_INTERACTIVE = "interactive"
+PRIORITY_BULK = "bulk"
+PRIORITY_WEIGHTS = {PRIORITY_CONTROL: 16, PRIORITY_INTERACTIVE: 4, PRIORITY_BULK: 1}
+
 # Reusable client bus for outbound GATT operations
 _client_bus = None
 _client_obj_manager = None
@@ -35,14 +62,44 @@ async def init_bus_and_manager():
     obj_manager = root_obj.get_interface("org.freedesktop.DBus.ObjectManager")
     return bus, obj_manager
 
-async def get_adapter_path(obj_manager):
+async def get_adapter_paths(obj_manager):
     managed_initial = await obj_manager.call_get_managed_objects()
-    adapter_paths = [p for p, ifaces in managed_initial.items() if "org.bluez.Adapter1" in ifaces]
+    adapter_paths = sorted(p for p, ifaces in managed_initial.items() if "org.bluez.Adapter1" in ifaces)
     if not adapter_paths:
         print("No Bluetooth adapter found. Is bluetoothd running and hardware present?")
+    return adapter_paths
+
+async def get_adapter_path(obj_manager):
+    # Primary adapter, used for advertising and the GATT server so the node keeps one address
+    adapter_paths = await get_adapter_paths(obj_manager)
+    if not adapter_paths:
         return None
     return adapter_paths[0]
 
+def set_adapter_roles(roles):
+    # roles maps adapter path -> iterable of ADAPTER_ROLE_* values, e.g.
+    # {"/org/bluez/hci0": ["scan"], "/org/bluez/hci1": ["connect"], "/org/bluez/hci2": ["connect"]}
+    adapter_roles.clear()
+    for adapter_path, path_roles in roles.items():
+        path_roles = set(path_roles)
+        unknown = path_roles.difference(ADAPTER_ROLES)
+        if unknown:
+            raise ValueError(f"Unknown adapter roles for {adapter_path}: {sorted(unknown)}")
+        adapter_roles[adapter_path] = path_roles
+
+def get_adapter_roles(adapter_path):
+    return adapter_roles.get(adapter_path, set(ADAPTER_ROLES))
+
+async def get_adapter_paths_for_role(obj_manager, role):
+    adapter_paths = await get_adapter_paths(obj_manager)
+    return [p for p in adapter_paths if role in get_adapter_roles(p)]
+
+def pick_least_loaded_adapter(adapter_paths):
+    # Fewest open outbound connections wins; ties go to the first adapter in path order
+    if not adapter_paths:
+        return None
+    return min(adapter_paths, key=lambda p: adapter_load.get(p, 0))
+
 def get_neighbors():
     return neighbor_table
 
@@ -52,22 +109,27 @@ def get_known_devices():
 async def scan_for_mesh(on_device, ttl_config=5):
     bus, obj_manager = await init_bus_and_manager()
 
-    adapter_path = await get_adapter_path(obj_manager)
-    if not adapter_path:
+    adapter_paths = await get_adapter_paths_for_role(obj_manager, ADAPTER_ROLE_SCAN)
+    if not adapter_paths:
         return None
-
-    introspection = await bus.introspect("org.bluez", adapter_path)
-    obj = bus.get_proxy_object("org.bluez", adapter_path, introspection)
-    adapter = obj.get_interface("org.bluez.Adapter1")
-    adapter_props = obj.get_interface("org.freedesktop.DBus.Properties")
-
-    await adapter_props.call_set("org.bluez.Adapter1", "Powered", Variant("b", True))
-    try:
-        await adapter.call_set_discovery_filter({"Transport": Variant("s", "le"), "DuplicateData": Variant("b", True)})
-    except Exception:
-        pass
-
-    await adapter.call_start_discovery()
+    # BlueZ keeps Device1 objects per adapter and can only connect an adapter to devices it
+    # has discovered itself, so connect-only adapters discover too. The radio scheduler turns
+    # their discovery off while they have outbound sessions open.
+    for adapter_path in await get_adapter_paths_for_role(obj_manager, ADAPTER_ROLE_CONNECT):
+        if adapter_path not in adapter_paths:
+            adapter_paths.append(adapter_path)
+
+    # Discover on every scanning adapter; devices seen by any of them land in the same tables
+    for adapter_path in adapter_paths:
+        introspection = await bus.introspect("org.bluez", adapter_path)
+        obj = bus.get_proxy_object("org.bluez", adapter_path, introspection)
+        adapter = obj.get_interface("org.bluez.Adapter1")
+        adapter_props = obj.get_interface("org.freedesktop.DBus.Properties")
+
+        await adapter_props.call_set("org.bluez.Adapter1", "Powered", Variant("b", True))
+        # Discovery itself is owned by the radio scheduler on the shared client bus, since
+        # BlueZ only lets the D-Bus client that started discovery stop it
+        await radio_scheduler.acquire_scan(adapter_path)
 
     device_state = {}
 
@@ -154,25 +216,26 @@ async def scan_for_mesh(on_device, ttl_config=5):
             on_iface_added(path, ifaces)
 
     class ScanHandle:
-        def __init__(self, bus, adapter):
+        def __init__(self, bus, adapter_paths):
             self._bus = bus
-            self._adapter = adapter
+            self._adapter_paths = adapter_paths
             self._stopped = False
 
         async def stop(self):
             if self._stopped:
                 return
-            try:
-                await self._adapter.call_stop_discovery()
-            except Exception:
-                pass
+            for adapter_path in self._adapter_paths:
+                try:
+                    await radio_scheduler.release_scan(adapter_path)
+                except Exception:
+                    pass
             try:
                 self._bus.disconnect()
             except Exception:
                 pass
             self._stopped = True
 
-    return ScanHandle(bus, adapter)
+    return ScanHandle(bus, adapter_paths)
 
 async def advertise(packet):
     bus, obj_manager = await init_bus_and_manager()
@@ -260,6 +323,65 @@ def parse_packet(packet):
     payload_bytes = packet[13:]
     return version, flags, seqnum, ttl, origin_id, payload_bytes
 
+def max_message_bytes(max_bytes=MAX_FRAME_BYTES):
+    # Largest message that fits in a frame of max_bytes (never more than BlueZ accepts)
+    return min(max_bytes, MAX_FRAME_BYTES) - FRAME_HEADER_BYTES - FRAME_LENGTH_BYTES
+
+def pack_messages(messages, max_bytes=MAX_FRAME_BYTES, frame_bytes=None):
+    # Pack messages into as few frames as possible, filling each up to frame_bytes (the link
+    # MTU, say). A message too large to share such a frame gets one of its own, which may
+    # grow up to max_bytes and goes out as a long write.
+    max_bytes = min(max_bytes, MAX_FRAME_BYTES)
+    frame_bytes = min(frame_bytes or max_bytes, max_bytes)
+    frames = []
+    body = bytearray()
+
+    def close_frame():
+        frames.append(bytes([FRAME_MARKER]) + (FRAME_HEADER_BYTES + len(body)).to_bytes(FRAME_LENGTH_BYTES, "big") + bytes(body))
+        body.clear()
+
+    for message in messages:
+        if len(message) > max_message_bytes(max_bytes):
+            raise ValueError(f"Message of {len(message)} bytes does not fit in a {max_bytes} byte frame")
+        record = len(message).to_bytes(FRAME_LENGTH_BYTES, "big") + bytes(message)
+        if body and FRAME_HEADER_BYTES + len(body) + len(record) > frame_bytes:
+            close_frame()
+        body += record
+    if body:
+        close_frame()
+    return frames
+
+def frame_length(data):
+    # Total length announced by an aggregated frame's header, or None for a plain write
+    if len(data) < FRAME_HEADER_BYTES or data[0] != FRAME_MARKER:
+        return None
+    return int.from_bytes(data[1:FRAME_HEADER_BYTES], "big")
+
+def unpack_frame(frame):
+    # Returns the messages in an aggregated frame, or [frame] for a plain write
+    frame = bytes(frame)
+    if frame_length(frame) != len(frame):
+        return [frame]
+    messages = []
+    offset = FRAME_HEADER_BYTES
+    while offset < len(frame):
+        if offset + FRAME_LENGTH_BYTES > len(frame):
+            return [frame]
+        length = int.from_bytes(frame[offset:offset + FRAME_LENGTH_BYTES], "big")
+        offset += FRAME_LENGTH_BYTES
+        if offset + length > len(frame):
+            return [frame]
+        messages.append(frame[offset:offset + length])
+        offset += length
+    return messages
+
+def get_frame_limit(device_address, max_bytes=MAX_FRAME_BYTES):
+    # Largest frame that fits in a single ATT write to the device (MTU minus 3 header bytes)
+    mtu = link_mtu.get(device_address)
+    if mtu:
+        return max(min(max_bytes, mtu - 3), FRAME_HEADER_BYTES + FRAME_LENGTH_BYTES + 1)
+    return max_bytes
+
 def get_origin_id():
     if os.path.exists(ORIGIN_ID_FILE):
         with open(ORIGIN_ID_FILE, "rb") as f:
@@ -300,6 +422,8 @@ async def register_gatt_server(write_callback):
             super().__init__("org.bluez.GattCharacteristic1")
             self.path = path
             self.value = bytearray()
+            # Partially received long writes of aggregated frames, keyed by device path
+            self.partial = {}
         
         @dbus_property(access=PropertyAccess.READ)
         def UUID(self) -> "s":
@@ -319,8 +443,24 @@ async def register_gatt_server(write_callback):
 
         @method()
         def WriteValue(self, value: "ay", options: "a{sv}"):
+            value = bytes(value)
+            offset_v = options.get("offset")
+            offset = offset_v.value if offset_v is not None else 0
+            device_v = options.get("device")
+            device = device_v.value if device_v is not None else None
+            # Long (prepared) writes arrive as several calls with increasing offsets
+            partial = self.partial.pop(device, None)
+            if offset and partial is not None:
+                if len(partial) != offset:
+                    return
+                value = partial + value
+            expected = frame_length(value)
+            if expected is not None and len(value) < expected:
+                self.partial[device] = value
+                return
             self.value = value
-            write_callback(value)
+            for message in unpack_frame(value):
+                write_callback(message)
 
     class MeshService(ServiceInterface):
         def __init__(self, path):
@@ -402,47 +542,162 @@ async def find_characteristic(bus, dev_path, target_uuid):
 
     raise Exception("Characteristic not found")
 
-async def find_device_path_by_address(obj_manager, device_address):
+async def find_device_paths_by_address(obj_manager, device_address):
+    # BlueZ keeps a separate Device1 object per adapter that has seen the device;
+    # returns {adapter path: (device path, device props)}
     managed = await obj_manager.call_get_managed_objects()
+    found = {}
     for path, ifaces in managed.items():
         if "org.bluez.Device1" in ifaces:
             props = ifaces["org.bluez.Device1"]
             addr_variant = props.get("Address")
             if addr_variant and getattr(addr_variant, "value", None) == device_address:
-                return path
+                adapter_variant = props.get("Adapter")
+                adapter_path = getattr(adapter_variant, "value", None) or path.rsplit("/", 1)[0]
+                found[adapter_path] = (path, props)
+    return found
+
+async def find_device_path_by_address(obj_manager, device_address, adapter_path=None):
+    found = await find_device_paths_by_address(obj_manager, device_address)
+    if adapter_path is not None:
+        entry = found.get(adapter_path)
+        return entry[0] if entry else None
+    for path, _ in found.values():
+        return path
     return None
 
+async def connect_device_on_adapter(bus, adapter_path, device_address, known_props=None):
+    # Create and connect the device on an adapter that never discovered it (for example
+    # when a dedicated adapter does the scanning). Adapter1.ConnectDevice needs bluetoothd
+    # to run with --experimental; returns the new device path or None if unavailable.
+    address_type = "public"
+    if known_props:
+        address_type_v = known_props.get("AddressType")
+        if address_type_v is not None:
+            address_type = address_type_v.value
+    try:
+        adapter_intro = await bus.introspect("org.bluez", adapter_path)
+        adapter_obj = bus.get_proxy_object("org.bluez", adapter_path, adapter_intro)
+        adapter = adapter_obj.get_interface("org.bluez.Adapter1")
+        return await adapter.call_connect_device({"Address": Variant("s", device_address), "AddressType": Variant("s", address_type)})
+    except Exception:
+        return None
+
+async def close_packets(packets):
+    # Close the caller's (async) generator so its cleanup runs now, not at loop shutdown
+    try:
+        if hasattr(packets, "aclose"):
+            await packets.aclose()
+        elif hasattr(packets, "close"):
+            packets.close()
+    except Exception:
+        pass
+
+async def iter_packets(packets):
+    # Normalize a list, generator or async iterator of packets into an async iterator.
+    # Closing the returned iterator closes packets as well.
+    try:
+        if hasattr(packets, "__aiter__"):
+            async for packet in packets:
+                yield packet
+        else:
+            for packet in packets:
+                yield packet
+    finally:
+        await close_packets(packets)
+
 async def send_data(device_address, packets):
+    # packets may be a list or any (async) iterable of buffers. It is consumed lazily,
+    # one packet per GATT write, so the next buffer is only pulled from the source once
+    # the previous write has been acknowledged by the link.
+    source = iter_packets(packets)
     bus, obj_manager = await get_client_bus_and_manager()
     print(f"Sending data to {device_address}")
 
-    resolved_path = await find_device_path_by_address(obj_manager, device_address)
-    dev_path = resolved_path if resolved_path else f"/org/bluez/hci0/dev_{device_address.replace(':', '_')}"
-    print(f"Device path: {dev_path}")
+    # Spread outbound connections across connecting adapters, preferring ones that already
+    # know the device so no extra discovery is needed
+    connect_paths = await get_adapter_paths_for_role(obj_manager, ADAPTER_ROLE_CONNECT)
+    if not connect_paths:
+        await close_packets(packets)
+        raise Exception("No Bluetooth adapter with the connect role; check set_adapter_roles()")
+    found = await find_device_paths_by_address(obj_manager, device_address)
+    adapter_path = pick_least_loaded_adapter([p for p in connect_paths if p in found] or connect_paths)
+    adapter_load[adapter_path] = adapter_load.get(adapter_path, 0) + 1
+    # Discovery is kept off during outbound windows to avoid connection aborts while
+    # scanning; concurrent sends on the adapter share one window
+    hold = radio_scheduler.outbound(adapter_path)
+
+    try:
+        await hold.acquire()
+        if adapter_path in found:
+            dev_path = found[adapter_path][0]
+        else:
+            known_props = next(iter(found.values()))[1] if found else None
+            dev_path = await connect_device_on_adapter(bus, adapter_path, device_address, known_props)
+            if dev_path is None and found:
+                # Fall back to whichever adapter discovered the device, even though it
+                # does not have the connect role
+                adapter_path_fallback, (dev_path, _) = next(iter(found.items()))
+                print(f"WARNING: no connect adapter knows {device_address} and ConnectDevice failed "
+                      f"(is bluetoothd running with --experimental?); sending on {adapter_path_fallback} instead")
+                await hold.release()
+                adapter_load[adapter_path] -= 1
+                adapter_path = adapter_path_fallback
+                adapter_load[adapter_path] = adapter_load.get(adapter_path, 0) + 1
+                hold = radio_scheduler.outbound(adapter_path)
+                await hold.acquire()
+            elif dev_path is None:
+                dev_path = f"{adapter_path}/dev_{device_address.replace(':', '_')}"
+        print(f"Device path: {dev_path} (adapter {adapter_path})")
+        await _send_on_adapter(bus, obj_manager, adapter_path, dev_path, device_address, source, hold)
+    finally:
+        await hold.release()
+        adapter_load[adapter_path] -= 1
+        try:
+            await source.aclose()
+        except Exception:
+            pass
+        # The wrapper's finally never runs if it was closed before its first packet
+        await close_packets(packets)
+
+async def _next_packet(source, hold):
+    # Pull the next packet at a write boundary, the only point where a session gives up its
+    # outbound claim: while its source is slow, so an idle session doesn't keep discovery off
+    # for other senders, and when the window has expired, so scanning gets its slice. The
+    # claim is always back before the packet is handed out.
+    fetch = asyncio.ensure_future(source.__anext__())
+    try:
+        done, _ = await asyncio.wait({fetch}, timeout=radio_scheduler.idle_release)
+        if not done:
+            await hold.release()
+            await asyncio.wait({fetch})
+        if fetch.exception() is not None:
+            # Source ended or failed; no packet to write, so no need to wait for a window
+            return fetch.result()
+        if radio_scheduler.window_expired(hold.adapter_path):
+            await hold.release()
+        await hold.acquire()
+        return fetch.result()
+    finally:
+        if not fetch.done():
+            fetch.cancel()
+
+async def _send_on_adapter(bus, obj_manager, adapter_path, dev_path, device_address, source, hold):
     dev_obj = await bus.introspect("org.bluez", dev_path)
     dev = bus.get_proxy_object("org.bluez", dev_path, dev_obj)
     try:
         dev_iface = dev.get_interface("org.bluez.Device1")
     except Exception:
         return
-    
-    # Stop discovery to avoid connection aborts while scanning
-    adapter_path = await get_adapter_path(obj_manager)
-    if not adapter_path:
-        return
-    adapter_intro = await bus.introspect("org.bluez", adapter_path)
-    adapter_obj = bus.get_proxy_object("org.bluez", adapter_path, adapter_intro)
-    adapter = adapter_obj.get_interface("org.bluez.Adapter1")
 
     try:
-        try:
-            await adapter.call_stop_discovery()
-        except Exception:
-            pass
-
         dev_props = dev.get_interface("org.freedesktop.DBus.Properties")
 
         last_exc = None
+        source_exc = None
+        # Packet pulled from the source but not yet written; kept across retries so a
+        # reconnect resumes where the failed write left off instead of replaying the source
+        pending = None
         for attempt in range(1, 4):
             try:
                 # Connect if not connected
@@ -461,7 +716,7 @@ async def send_data(device_address, packets):
                         is_unknown_method = isinstance(e, DBusError) and (getattr(e, "name", "").endswith("UnknownMethod") or "UnknownMethod" in error_text or "doesn't exist" in error_text)
                         if is_unknown_method:
                             try:
-                                new_path = await find_device_path_by_address(obj_manager, device_address)
+                                new_path = await find_device_path_by_address(obj_manager, device_address, adapter_path)
                                 if new_path:
                                     dev_path = new_path
                                     dev_obj = await bus.introspect("org.bluez", dev_path)
@@ -492,9 +747,26 @@ async def send_data(device_address, packets):
                     pass
 
                 char_iface = await find_characteristic(bus, dev_path, MESH_CHARACTERISTIC_UUID)
-                for packet in packets:
-                    await char_iface.call_write_value(packet, {})
+                try:
+                    link_mtu[device_address] = await char_iface.get_mtu()
+                except Exception:
+                    pass
+                while True:
+                    if pending is None:
+                        try:
+                            pending = await _next_packet(source, hold)
+                        except StopAsyncIteration:
+                            break
+                        except Exception as e:
+                            # Errors raised by the source are not link errors, don't retry them
+                            source_exc = e
+                            break
+                    await char_iface.call_write_value(pending, {})
+                    pending = None
                     await asyncio.sleep(0.1)
+                if source_exc is not None:
+                    last_exc = None
+                    break
                 print("Data sent to device")
                 last_exc = None
                 break
@@ -505,6 +777,8 @@ async def send_data(device_address, packets):
                 except Exception:
                     pass
                 await asyncio.sleep(0.5 * attempt)
+        if source_exc is not None:
+            raise source_exc
         if last_exc is not None:
             raise last_exc
     finally:
@@ -520,7 +794,471 @@ async def send_data(device_address, packets):
                 print("Disconnected from device")
         except Exception:
             pass
+
+async def send_messages(device_address, messages, max_bytes=MAX_FRAME_BYTES, priority=PRIORITY_INTERACTIVE):
+    # Send small messages packed into as few writes as the link MTU allows
+    for message in messages:
+        if len(message) > max_message_bytes(max_bytes):
+            raise ValueError(f"Message of {len(message)} bytes does not fit in a {max_bytes} byte frame")
+
+    async def frames():
+        # Packed only when the session pulls the first frame, after it has recorded the MTU
+        for frame in pack_messages(messages, max_bytes, get_frame_limit(device_address, max_bytes)):
+            yield frame
+
+    await schedule_send(device_address, frames(), priority)
+
+class MessageAggregator:
+    # Buffers outgoing messages (bytes) and hands them to send (an async callable taking a
+    # list of messages) once max_bytes worth is buffered or max_delay seconds after the first
+    # one. Send failures are logged, whichever of the two triggered the flush.
+    def __init__(self, send, max_delay=0.05, max_bytes=MAX_FRAME_BYTES):
+        self.send = send
+        self.max_delay = max_delay
+        self.max_bytes = min(max_bytes, MAX_FRAME_BYTES)
+        self.queue = []
+        self._queued_bytes = 0
+        self._handle = None
+        self._lock = asyncio.Lock()
+        self._loop = None
+
+    async def add_message(self, message):
+        if not isinstance(message, (bytes, bytearray)):
+            raise TypeError("MessageAggregator takes bytes; encode text before adding it")
+        if self._loop is None:
+            self._loop = asyncio.get_running_loop()
+        if len(message) > max_message_bytes(self.max_bytes):
+            raise ValueError(f"Message of {len(message)} bytes does not fit in a {self.max_bytes} byte frame")
+        record_bytes = FRAME_LENGTH_BYTES + len(message)
+        batches = []
+        async with self._lock:
+            if self.queue and FRAME_HEADER_BYTES + self._queued_bytes + record_bytes > self.max_bytes:
+                # Send what is buffered now rather than spilling into a second, mostly empty frame
+                batches.append(self._take())
+            self.queue.append(message)
+            self._queued_bytes += record_bytes
+            if FRAME_HEADER_BYTES + self._queued_bytes >= self.max_bytes:
+                batches.append(self._take())
+            elif self._handle is None:
+                self._handle = self._loop.call_later(self.max_delay, lambda: asyncio.create_task(self.flush()))
+        for batch in batches:
+            await self._send(batch)
+
+    async def flush(self):
+        async with self._lock:
+            batch = self._take()
+        if batch:
+            await self._send(batch)
+
+    def _take(self):
+        # Must be called with self._lock held
+        if self._handle is not None:
+            self._handle.cancel()
+            self._handle = None
+        messages = list(self.queue)
+        self.queue.clear()
+        self._queued_bytes = 0
+        return messages
+
+    async def _send(self, messages):
         try:
-            await adapter.call_start_discovery()
-        except Exception:
-            pass
\ No newline at end of file
+            await self.send(messages)
+        except Exception as e:
+            print(f"Failed to send {len(messages)} aggregated messages: {e}")
+
+class SendScheduler:
+    # Per-destination send queues. Each destination has one worker that keeps a single
+    # send_data session open while anything is queued and picks the next packet by smooth
+    # weighted round robin across priority classes, so an interactive message only waits
+    # for the bulk write in flight rather than the whole transfer. The head submission of
+    # each class prefetches its next packet in the background and only classes with a
+    # packet ready are picked, so a slow source never holds up the other classes.
+
+    class _Submission:
+        def __init__(self, packets, priority):
+            self.packets = packets
+            self.source = iter_packets(packets)
+            self.priority = priority
+            self.future = asyncio.get_running_loop().create_future()
+            self.queued_at = time.monotonic()
+            self.started = False
+            self.fetch = None
+
+        def prefetch(self):
+            if self.fetch is None:
+                self.fetch = asyncio.ensure_future(self.source.__anext__())
+
+        async def close(self):
+            # Stop any prefetch, then close the caller's generator too (e.g. a file being
+            # streamed), even if the wrapper was never started
+            if self.fetch is not None and not self.fetch.done():
+                self.fetch.cancel()
+                try:
+                    await self.fetch
+                except BaseException:
+                    pass
+            try:
+                await self.source.aclose()
+            except Exception:
+                pass
+            await close_packets(self.packets)
+
+        def finish(self, exc=None):
+            if self.future.done():
+                return
+            if exc is None:
+                self.future.set_result(None)
+            else:
+                self.future.set_exception(exc)
+
+    class _Destination:
+        def __init__(self, priorities):
+            self.queues = {priority: [] for priority in priorities}
+            self.credit = {priority: 0 for priority in priorities}
+            self.worker = None
+            self.drained = False
+            # Set when a submission is queued, to wake a worker waiting on slow sources
+            self.changed = asyncio.Event()
+            self.wait_total = {priority: 0.0 for priority in priorities}
+            self.wait_max = {priority: 0.0 for priority in priorities}
+            self.started_count = {priority: 0 for priority in priorities}
+            self.packets_sent = {priority: 0 for priority in priorities}
+
+    def __init__(self, weights=None, send=None):
+        self.weights = dict(weights or PRIORITY_WEIGHTS)
+        # send(device_address, packets) defaults to send_data; looked up lazily so it can be patched
+        self._send = send
+        self._destinations = {}
+
+    async def submit(self, device_address, packets, priority=PRIORITY_INTERACTIVE):
+        # Queue packets (list or any async iterable) and wait until they have all been written
+        if priority not in self.weights:
+            raise ValueError(f"Unknown priority class: {priority}")
+        dest = self._destinations.get(device_address)
+        if dest is None:
+            dest = self._destinations[device_address] = self._Destination(self.weights)
+        submission = self._Submission(packets, priority)
+        dest.queues[priority].append(submission)
+        dest.changed.set()
+        if dest.worker is None or dest.worker.done():
+            dest.worker = asyncio.create_task(self._run(device_address, dest))
+        try:
+            await submission.future
+        finally:
+            if submission.future.cancelled():
+                # The caller gave up (e.g. an aborted file transfer); don't send the rest
+                queue = dest.queues[priority]
+                if submission in queue:
+                    queue.remove(submission)
+                    dest.changed.set()
+                await submission.close()
+
+    def _pick(self, dest, active):
+        # Smooth weighted round robin over the classes that have a packet ready
+        # Idle classes start from zero when they become active again
+        for priority, queue in dest.queues.items():
+            if not queue:
+                dest.credit[priority] = 0
+        if not active:
+            return None
+        total = 0
+        for priority in active:
+            dest.credit[priority] += self.weights[priority]
+            total += self.weights[priority]
+        chosen = max(active, key=lambda p: dest.credit[p])
+        dest.credit[chosen] -= total
+        return chosen
+
+    async def _retire_finished(self, dest):
+        # Start prefetching for the head of each class and retire heads whose source has
+        # ended or failed, passing the outcome to their caller
+        for queue in dest.queues.values():
+            while queue:
+                submission = queue[0]
+                submission.prefetch()
+                fetch = submission.fetch
+                if not fetch.done() or (not fetch.cancelled() and fetch.exception() is None):
+                    break
+                queue.pop(0)
+                exc = None if fetch.cancelled() else fetch.exception()
+                submission.finish(None if isinstance(exc, StopAsyncIteration) else exc)
+                await submission.close()
+
+    async def _packets(self, dest):
+        # Prefetching starts only once the session pulls, so sources see the link set up
+        # (send_messages relies on this to pack to the recorded MTU)
+        while True:
+            dest.changed.clear()
+            await self._retire_finished(dest)
+            heads = {p: queue[0] for p, queue in dest.queues.items() if queue}
+            if not heads:
+                dest.drained = True
+                return
+            ready = [p for p, submission in heads.items() if submission.fetch.done()]
+            if not ready:
+                # Wait for any source to produce its next packet, or a new submission
+                changed = asyncio.ensure_future(dest.changed.wait())
+                try:
+                    await asyncio.wait([submission.fetch for submission in heads.values()] + [changed], return_when=asyncio.FIRST_COMPLETED)
+                finally:
+                    changed.cancel()
+                continue
+            priority = self._pick(dest, ready)
+            submission = heads[priority]
+            packet = submission.fetch.result()
+            submission.fetch = None
+            if not submission.started:
+                submission.started = True
+                waited = time.monotonic() - submission.queued_at
+                dest.wait_total[priority] += waited
+                dest.wait_max[priority] = max(dest.wait_max[priority], waited)
+                dest.started_count[priority] += 1
+            yield packet
+            # The write has completed once the session asks for the next packet
+            dest.packets_sent[priority] += 1
+
+    async def _run(self, device_address, dest):
+        send = self._send or send_data
+        # Loop for submissions that arrived while the previous session was disconnecting
+        while any(dest.queues.values()):
+            dest.drained = False
+            try:
+                await send(device_address, self._packets(dest))
+            except Exception as e:
+                await self._fail_queued(dest, e)
+                return
+            if not dest.drained:
+                # The session gave up without consuming everything (e.g. device not found)
+                await self._fail_queued(dest, Exception(f"Send to {device_address} ended early"))
+                return
+
+    async def _fail_queued(self, dest, exc):
+        submissions = [submission for queue in dest.queues.values() for submission in queue]
+        for queue in dest.queues.values():
+            queue.clear()
+        for submission in submissions:
+            submission.finish(exc)
+            await submission.close()
+
+    def stats(self):
+        # {device address: {priority: {"queued", "packets_sent", "avg_wait", "max_wait"}}}
+        report = {}
+        for device_address, dest in self._destinations.items():
+            report[device_address] = {
+                priority: {
+                    "queued": len(dest.queues[priority]),
+                    "packets_sent": dest.packets_sent[priority],
+                    "avg_wait": dest.wait_total[priority] / dest.started_count[priority] if dest.started_count[priority] else 0.0,
+                    "max_wait": dest.wait_max[priority],
+                }
+                for priority in self.weights
+            }
+        return report
+
+send_scheduler = SendScheduler()
+
+async def schedule_send(device_address, packets, priority=PRIORITY_INTERACTIVE):
+    await send_scheduler.submit(device_address, packets, priority)
+
+class RadioScheduler:
+    # Shares each adapter's radio between discovery and outbound connections. Scanners and
+    # outbound sessions are reference counted and the adapter alternates between two phases:
+    # an outbound window with discovery off, shared by every session that starts during it,
+    # and a scan slice with discovery on. After max_outbound_window seconds a window expires:
+    # new sessions stop joining it and running sessions step out at their next write
+    # boundary (never while connecting). Once the last one has stepped out, scanning gets a
+    # slice sized so it has scan_share of radio time (at least min_scan_slice), and all
+    # waiting sessions then start together in the next window.
+
+    PHASE_SCAN = "scan"
+    PHASE_OUTBOUND = "outbound"
+
+    class _AdapterState:
+        def __init__(self):
+            self.scanners = 0
+            # Sessions holding the current window, and sessions waiting for the next one
+            self.outbound = 0
+            self.waiting = 0
+            self.phase = RadioScheduler.PHASE_SCAN
+            self.expired = False
+            self.discovering = False
+            self.filter_set = False
+            self.window_start = 0.0
+            self.scan_until = 0.0
+            self.timer = None
+            self.retry = None
+            self.toggles = 0
+            self.adapter = None
+            self.cond = asyncio.Condition()
+            self.lock = asyncio.Lock()
+
+    class OutboundHold:
+        # One session's claim on an adapter's outbound window. acquire() and release() are
+        # idempotent, so a session can release while idle and a cancelled session can always
+        # call release() in its cleanup without unbalancing the counts.
+        def __init__(self, scheduler, adapter_path):
+            self.scheduler = scheduler
+            self.adapter_path = adapter_path
+            self.active = False
+
+        async def acquire(self):
+            if not self.active:
+                await self.scheduler._begin_outbound(self)
+
+        async def release(self):
+            if self.active:
+                self.active = False
+                await self.scheduler._end_outbound(self.adapter_path)
+
+    def __init__(self, scan_share=0.25, max_outbound_window=5.0, min_scan_slice=0.5, idle_release=0.5):
+        if not 0 <= scan_share < 1:
+            raise ValueError("scan_share must be in [0, 1)")
+        self.scan_share = scan_share
+        self.max_outbound_window = max_outbound_window
+        self.min_scan_slice = min_scan_slice
+        # Sessions waiting this long on their packet source give up their outbound claim
+        self.idle_release = idle_release
+        self._adapters = {}
+
+    def _state(self, adapter_path):
+        state = self._adapters.get(adapter_path)
+        if state is None:
+            state = self._adapters[adapter_path] = self._AdapterState()
+        return state
+
+    def outbound(self, adapter_path):
+        return self.OutboundHold(self, adapter_path)
+
+    async def acquire_scan(self, adapter_path):
+        state = self._state(adapter_path)
+        async with state.cond:
+            state.scanners += 1
+            self._advance(adapter_path, state)
+        await self._apply(adapter_path, state)
+
+    async def release_scan(self, adapter_path):
+        state = self._state(adapter_path)
+        async with state.cond:
+            state.scanners = max(state.scanners - 1, 0)
+            self._advance(adapter_path, state)
+        await self._apply(adapter_path, state)
+
+    def window_expired(self, adapter_path):
+        # True once the current window is out of time; sessions should step out at a write boundary
+        state = self._state(adapter_path)
+        return state.phase == self.PHASE_OUTBOUND and state.expired
+
+    async def _begin_outbound(self, hold):
+        state = self._state(hold.adapter_path)
+        async with state.cond:
+            state.waiting += 1
+            try:
+                self._advance(hold.adapter_path, state)
+                while state.phase != self.PHASE_OUTBOUND or state.expired:
+                    await state.cond.wait()
+            finally:
+                state.waiting -= 1
+            state.outbound += 1
+            hold.active = True
+            self._advance(hold.adapter_path, state)
+        await self._apply(hold.adapter_path, state)
+
+    async def _end_outbound(self, adapter_path):
+        state = self._state(adapter_path)
+        async with state.cond:
+            state.outbound = max(state.outbound - 1, 0)
+            self._advance(adapter_path, state)
+        await self._apply(adapter_path, state)
+
+    async def _tick(self, adapter_path):
+        state = self._state(adapter_path)
+        async with state.cond:
+            self._advance(adapter_path, state)
+        await self._apply(adapter_path, state)
+
+    def _advance(self, adapter_path, state):
+        # Move between phases based on the counts and the clock, then arm the timer for the
+        # next deadline. Must be called with state.cond held.
+        now = time.monotonic()
+        if state.phase == self.PHASE_OUTBOUND:
+            window = now - state.window_start
+            if state.outbound == 0:
+                # Only closes once every session has stepped out, so none is mid-connect
+                state.phase = self.PHASE_SCAN
+                state.expired = False
+                if state.scanners:
+                    scan_slice = max(self.min_scan_slice, window * self.scan_share / (1 - self.scan_share))
+                    state.scan_until = now + scan_slice
+            elif state.scanners and window >= self.max_outbound_window:
+                state.expired = True
+        if state.phase == self.PHASE_SCAN and state.waiting > 0 and (not state.scanners or now >= state.scan_until):
+            state.phase = self.PHASE_OUTBOUND
+            state.window_start = now
+
+        if state.timer is not None:
+            state.timer.cancel()
+            state.timer = None
+        deadline = None
+        if state.scanners and state.phase == self.PHASE_OUTBOUND and not state.expired:
+            deadline = state.window_start + self.max_outbound_window
+        elif state.scanners and state.phase == self.PHASE_SCAN and state.waiting > 0:
+            deadline = state.scan_until
+        if deadline is not None:
+            loop = asyncio.get_running_loop()
+            state.timer = loop.call_later(max(deadline - now, 0), lambda: asyncio.create_task(self._tick(adapter_path)))
+        state.cond.notify_all()
+
+    async def _apply(self, adapter_path, state):
+        # Serialized per adapter; whoever runs last sees the final state, so discovery converges
+        async with state.lock:
+            want = state.scanners > 0 and state.phase == self.PHASE_SCAN
+            if want == state.discovering:
+                return
+            try:
+                bus, obj_manager = await get_client_bus_and_manager()
+                if state.adapter is None:
+                    adapter_intro = await bus.introspect("org.bluez", adapter_path)
+                    adapter_obj = bus.get_proxy_object("org.bluez", adapter_path, adapter_intro)
+                    state.adapter = adapter_obj.get_interface("org.bluez.Adapter1")
+                if want:
+                    if not state.filter_set:
+                        try:
+                            await state.adapter.call_set_discovery_filter({"Transport": Variant("s", "le"), "DuplicateData": Variant("b", True)})
+                        except Exception:
+                            pass
+                        state.filter_set = True
+                    await state.adapter.call_start_discovery()
+                else:
+                    await state.adapter.call_stop_discovery()
+            except Exception as e:
+                # InProgress means discovery is already running for this client
+                if not (want and isinstance(e, DBusError) and getattr(e, "type", "").endswith("InProgress")):
+                    print(f"Failed to {'start' if want else 'stop'} discovery on {adapter_path}: {e}")
+                    # e.g. NotReady while the adapter powers up; try again shortly
+                    if state.retry is None or state.retry.done():
+                        state.retry = asyncio.create_task(self._retry(adapter_path, state))
+                    return
+            state.discovering = want
+            state.toggles += 1
+
+    async def _retry(self, adapter_path, state):
+        await asyncio.sleep(1.0)
+        state.retry = None
+        await self._apply(adapter_path, state)
+
+    def stats(self):
+        # {adapter path: {"scanners", "outbound", "waiting", "phase", "expired", "discovering", "toggles"}}
+        return {
+            adapter_path: {
+                "scanners": state.scanners,
+                "outbound": state.outbound,
+                "waiting": state.waiting,
+                "phase": state.phase,
+                "expired": state.expired,
+                "discovering": state.discovering,
+                "toggles": state.toggles,
+            }
+            for adapter_path, state in self._adapters.items()
+        }
+
+radio_scheduler = RadioScheduler()